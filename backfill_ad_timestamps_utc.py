@@ -0,0 +1,47 @@
+"""
+One-shot migration: shift sponsored ads created before timestamps were stored as true UTC.
+Those ads hold created_at/expires_at with a +1h WAT offset baked in, so they stay active for
+up to an hour past expiry until corrected.
+
+    python backfill_ad_timestamps_utc.py 2026-10-16T09:00:00Z
+
+The argument is when the UTC change was deployed. Ads are selected by the creation time in
+their ObjectId (always real UTC) rather than by created_at, which is the shifted value.
+Corrected ads are tagged with timestamps_utc so a second run does not shift them again.
+"""
+import os
+import sys
+from datetime import datetime
+from bson import ObjectId
+from dotenv import load_dotenv
+from pymongo import MongoClient
+
+load_dotenv()
+
+WAT_OFFSET_MS = 60 * 60 * 1000
+
+
+def main():
+    if len(sys.argv) != 2:
+        sys.exit(__doc__)
+    cutoff = datetime.fromisoformat(sys.argv[1].replace('Z', '+00:00'))
+    if cutoff.tzinfo is None:
+        sys.exit("Cutoff must include a UTC offset, e.g. 2026-10-16T09:00:00Z")
+
+    client = MongoClient(os.environ.get('MONGO_URI'))
+    collection = client.get_database().sponsored_ads
+
+    result = collection.update_many(
+        {'_id': {'$lt': ObjectId.from_datetime(cutoff)}, 'timestamps_utc': {'$exists': False}},
+        [{'$set': {
+            'created_at': {'$subtract': ['$created_at', WAT_OFFSET_MS]},
+            'expires_at': {'$subtract': ['$expires_at', WAT_OFFSET_MS]},
+            'timestamps_utc': True
+        }}]
+    )
+    print(f"✅ Shifted timestamps on {result.modified_count} ads created before {cutoff.isoformat()}")
+    client.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""
+One-shot migration: fill in image_public_id for faculty wear products created before
+public ids were stored, by matching their image_url against the Cloudinary folder listing.
+
+    python backfill_image_public_ids.py
+"""
+import os
+from dotenv import load_dotenv
+from pymongo import MongoClient, UpdateOne
+import cloudinary.api
+from uploads import configure_cloudinary
+
+load_dotenv()
+
+FOLDER = 'faculty_wear'
+
+
+def list_folder_resources():
+    """Map secure_url -> public_id for every image uploaded under FOLDER"""
+    urls = {}
+    next_cursor = None
+    while True:
+        page = cloudinary.api.resources(
+            type='upload',
+            prefix=f'{FOLDER}/',
+            max_results=500,
+            next_cursor=next_cursor
+        )
+        for resource in page.get('resources', []):
+            urls[resource['secure_url']] = resource['public_id']
+        next_cursor = page.get('next_cursor')
+        if not next_cursor:
+            return urls
+
+
+def main():
+    configure_cloudinary()
+    client = MongoClient(os.environ.get('MONGO_URI'))
+    collection = client.get_database()[FOLDER]
+
+    urls = list_folder_resources()
+    print(f"Found {len(urls)} Cloudinary images under {FOLDER}/")
+
+    updates = []
+    unmatched = 0
+    for item in collection.find({'image_public_id': None, 'image_url': {'$nin': [None, '']}},
+                                {'image_url': 1}):
+        public_id = urls.get(item['image_url'])
+        if public_id:
+            updates.append(UpdateOne({'_id': item['_id']}, {'$set': {'image_public_id': public_id}}))
+        else:
+            unmatched += 1
+
+    if updates:
+        result = collection.bulk_write(updates, ordered=False)
+        print(f"✅ Backfilled image_public_id on {result.modified_count} products")
+    print(f"Skipped {unmatched} products whose image_url is not in {FOLDER}/")
+    client.close()
+
+
+if __name__ == '__main__':
+    main()
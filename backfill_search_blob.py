@@ -0,0 +1,70 @@
+"""
+One-shot migration: lowercase legacy nicknames, fill in search_blob for users created before
+get_users switched to the search_blob text index, then build the unique nickname index that
+signin's exact-match lookup relies on.
+
+    python backfill_search_blob.py
+
+Nicknames that differ only by case would collide once lowercased. They are reported and the
+script stops before writing anything, so they can be renamed by hand first.
+"""
+import os
+import sys
+from dotenv import load_dotenv
+from pymongo import MongoClient
+from users import SEARCH_BLOB_EXPR
+
+load_dotenv()
+
+NORMALIZED_NICKNAME = {'$toLower': {'$trim': {'input': '$nickname'}}}
+
+
+def find_nickname_collisions(collection):
+    """Group users whose nicknames are equal after trimming and lowercasing"""
+    return list(collection.aggregate([
+        {'$match': {'nickname': {'$type': 'string'}}},
+        {'$group': {
+            '_id': NORMALIZED_NICKNAME,
+            'users': {'$push': {'id': '$_id', 'nickname': '$nickname'}},
+            'count': {'$sum': 1}
+        }},
+        {'$match': {'count': {'$gt': 1}}}
+    ]))
+
+
+def main():
+    client = MongoClient(os.environ.get('MONGO_URI'))
+    collection = client.get_database().users
+
+    collisions = find_nickname_collisions(collection)
+    if collisions:
+        print(f"❌ {len(collisions)} nicknames collide once lowercased; rename these users first:")
+        for group in collisions:
+            users = ', '.join(f"{user['nickname']!r} ({user['id']})" for user in group['users'])
+            print(f"  {group['_id']}: {users}")
+        client.close()
+        sys.exit(1)
+
+    result = collection.update_many(
+        {'nickname': {'$type': 'string'}},
+        [{'$set': {'nickname': NORMALIZED_NICKNAME}}]
+    )
+    print(f"✅ Normalized {result.modified_count} nicknames")
+
+    result = collection.update_many(
+        {'search_blob': {'$exists': False}},
+        [{'$set': {'search_blob': SEARCH_BLOB_EXPR}}]
+    )
+    print(f"✅ Backfilled search_blob on {result.modified_count} users")
+
+    collection.create_index(
+        'nickname',
+        unique=True,
+        partialFilterExpression={'nickname': {'$type': 'string'}}
+    )
+    print("✅ Unique nickname index in place")
+    client.close()
+
+
+if __name__ == '__main__':
+    main()
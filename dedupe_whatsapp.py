@@ -0,0 +1,72 @@
+"""
+One-shot migration: find accounts sharing a WhatsApp number, then build the unique whatsapp
+index that signup and profile updates rely on.
+
+    python dedupe_whatsapp.py          # report duplicates only
+    python dedupe_whatsapp.py --apply  # clear the number on all but the most recently active
+                                       # account in each group, then build the index
+
+Cleared accounts keep everything else. They get whatsapp_conflict set to the old number so
+support can follow up, and the user can set a number again from their profile.
+"""
+import os
+import sys
+from dotenv import load_dotenv
+from pymongo import MongoClient, UpdateOne
+
+load_dotenv()
+
+
+def find_duplicates(collection):
+    """Group accounts by whatsapp, most recently active first within each group"""
+    return list(collection.aggregate([
+        {'$match': {'whatsapp': {'$type': 'string'}}},
+        {'$sort': {'last_active': -1, 'last_login': -1, '_id': -1}},
+        {'$group': {
+            '_id': '$whatsapp',
+            'users': {'$push': {'id': '$_id', 'nickname': '$nickname'}},
+            'count': {'$sum': 1}
+        }},
+        {'$match': {'count': {'$gt': 1}}}
+    ]))
+
+
+def main():
+    apply = '--apply' in sys.argv[1:]
+    client = MongoClient(os.environ.get('MONGO_URI'))
+    collection = client.get_database().users
+
+    duplicates = find_duplicates(collection)
+    print(f"Found {len(duplicates)} WhatsApp numbers shared by more than one account")
+
+    updates = []
+    for group in duplicates:
+        keep, *others = group['users']
+        cleared = ', '.join(f"{user.get('nickname')} ({user['id']})" for user in others)
+        print(f"  {group['_id']}: keeping {keep.get('nickname')} ({keep['id']}), clearing {cleared}")
+        for user in others:
+            updates.append(UpdateOne(
+                {'_id': user['id'], 'whatsapp': group['_id']},
+                {'$set': {'whatsapp_conflict': group['_id']}, '$unset': {'whatsapp': ''}}
+            ))
+
+    if not apply:
+        if duplicates:
+            print("Re-run with --apply to clear the duplicates and build the index")
+            client.close()
+            sys.exit(1)
+    elif updates:
+        result = collection.bulk_write(updates, ordered=False)
+        print(f"✅ Cleared whatsapp on {result.modified_count} accounts")
+
+    collection.create_index(
+        'whatsapp',
+        unique=True,
+        partialFilterExpression={'whatsapp': {'$type': 'string'}}
+    )
+    print("✅ Unique whatsapp index in place")
+    client.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,89 @@
+import os
+import orjson
+from flask import current_app, request
 from flask_pymongo import PyMongo
+from flask_caching import Cache
+from bson import ObjectId, Decimal128
+from bson.errors import InvalidId
+from werkzeug.exceptions import BadRequest
+from bson.codec_options import CodecOptions, TypeDecoder, TypeRegistry
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 50
+MAX_BULK_DELETE_IDS = 100
 
 mongo = PyMongo()
+cache = Cache()
 db = None
 
 def init_extensions(app):
     global db
     mongo.init_app(app)
     db = mongo.db  # assign after init
+
+    # Redis shares cached responses (and their invalidation) across workers. Without it each
+    # worker has its own SimpleCache: a write only invalidates the worker that handled it,
+    # and other workers can serve stale entries until their timeout expires.
+    redis_url = os.environ.get('REDIS_URL')
+    app.config.setdefault('CACHE_TYPE', 'RedisCache' if redis_url else 'SimpleCache')
+    app.config.setdefault('CACHE_REDIS_URL', redis_url)
+    cache.init_app(app)
+    if app.config['CACHE_TYPE'] == 'SimpleCache' and os.environ.get('FLASK_ENV') != 'development':
+        app.logger.warning("REDIS_URL is not set; cached responses are per-worker and are only "
+                           "invalidated in the worker that handled the write")
+
+
+def parse_object_id(value, error=None):
+    """
+    Parse an ObjectId string once (ObjectId() already validates the hex). Malformed ids give
+    None, or raise BadRequest(error) when an error message is passed.
+    """
+    # ObjectId(None) would mint a fresh id, so only strings are accepted
+    if isinstance(value, str):
+        try:
+            return ObjectId(value)
+        except InvalidId:
+            pass
+    if error:
+        raise BadRequest(error)
+    return None
+
+
+def get_page_args(size_arg='page_size', default_size=DEFAULT_PAGE_SIZE):
+    """Read ?page= and the page size argument; return (page, page_size) with page_size capped"""
+    page = max(request.args.get('page', 1, type=int), 1)
+    page_size = min(max(request.args.get(size_arg, default_size, type=int), 1), MAX_PAGE_SIZE)
+    return page, page_size
+
+
+class ObjectIdDecoder(TypeDecoder):
+    bson_type = ObjectId
+
+    def transform_bson(self, value):
+        return str(value)
+
+class Decimal128Decoder(TypeDecoder):
+    bson_type = Decimal128
+
+    def transform_bson(self, value):
+        return float(value.to_decimal())
+
+def _orjson_default(obj):
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    if isinstance(obj, Decimal128):
+        return float(obj.to_decimal())
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_NAIVE_UTC | orjson.OPT_UTC_Z
+
+def dump_json(payload):
+    """Serialize to JSON bytes with orjson; ObjectId/Decimal128 are handled at encode time"""
+    return orjson.dumps(payload, default=_orjson_default, option=ORJSON_OPTIONS)
+
+def ojsonify(payload, status=200):
+    """Drop-in replacement for jsonify backed by orjson"""
+    return current_app.response_class(dump_json(payload), status=status, mimetype='application/json')
+
+# Decode ObjectId/Decimal128 straight into JSON-friendly values at BSON-decode time
+JSON_CODEC_OPTIONS = CodecOptions(type_registry=TypeRegistry([ObjectIdDecoder(), Decimal128Decoder()]))
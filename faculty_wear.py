@@ -1,317 +1,403 @@
-from flask import Blueprint, request, jsonify, current_app
-from bson import ObjectId
+from flask import Blueprint, request, current_app
+from pymongo import ReturnDocument
 from werkzeug.exceptions import BadRequest, NotFound
 import datetime
 import cloudinary
 import cloudinary.uploader
+import cloudinary.utils
 import cloudinary.api
 import os
+import time
+import uuid
+from extensions import (JSON_CODEC_OPTIONS, dump_json, ojsonify, parse_object_id, get_page_args,
+                        MAX_BULK_DELETE_IDS)
+from uploads import (parse_multipart_stream, configure_cloudinary, verify_cloudinary_async,
+                     delete_images_async, ALLOWED_IMAGE_FORMATS, CLOUDINARY_CHUNK_SIZE,
+                     MAX_IMAGE_SIZE)
+from users import requires_admin
 print("✅ faculty wear module initialized")
 faculty_wear_bp = Blueprint('faculty_wear', __name__, url_prefix='/api/faculty-wear')
 collection = None
 
+REQUIRED_FIELDS = ('title', 'description', 'standard_price',
+                   'custom_price', 'add_to_cart_text', 'buy_now_text')
+REQUIRED_TEXT_FIELDS = ('title', 'description', 'add_to_cart_text', 'buy_now_text')
+# (field, default) pairs
+OPTIONAL_FIELDS = (('badge_text', ''), ('add_to_cart_link', '#'), ('buy_now_link', '#'))
+FORM_FIELDS = REQUIRED_FIELDS + tuple(field for field, _ in OPTIONAL_FIELDS) + ('image_url',)
+IMAGE_MAX_WIDTH = 1200
+INVALID_ID_MESSAGE = "Invalid product ID format"
+LIST_PROJECTION = {"description": 0}
+UPLOAD_FOLDER = "faculty_wear"
+
+def image_delivery_url(public_id):
+    """Build the optimized delivery URL for a stored image (computed locally, no API call)"""
+    return cloudinary.CloudinaryImage(public_id).build_url(
+        quality="auto",
+        fetch_format="auto",
+        width=IMAGE_MAX_WIDTH,
+        crop="limit"
+    )
+
+def serialize_wear(item):
+    # _id and Decimal128 prices are already decoded by JSON_CODEC_OPTIONS
+    if item.get('image_public_id'):
+        item['image_url'] = image_delivery_url(item['image_public_id'])
+    return item
+
+def build_wear_fields(data, now):
+    """Validate a product payload and return the fields to store (excluding the image)"""
+    missing_fields = [field for field in REQUIRED_FIELDS if not data.get(field)]
+    if missing_fields:
+        raise BadRequest(f"Missing required fields: {', '.join(missing_fields)}")
+
+    # Validate prices
+    try:
+        standard_price = float(data['standard_price'])
+        custom_price = float(data['custom_price'])
+        if standard_price < 0 or custom_price < 0:
+            raise ValueError("Prices cannot be negative")
+    except ValueError:
+        raise BadRequest("Invalid price format")
+
+    fields = {field: data[field].strip() for field in REQUIRED_TEXT_FIELDS}
+    for field, default in OPTIONAL_FIELDS:
+        fields[field] = data.get(field, default).strip()
+    fields['standard_price'] = standard_price
+    fields['custom_price'] = custom_price
+    fields['updated_at'] = now
+    return fields
+
+def direct_upload_image(data, item_oid=None):
+    """
+    Return (secure_url, public_id) for an image the browser uploaded via /upload-signature,
+    or None. The asset is checked against Cloudinary, since the id comes from the client:
+    it must exist, respect the same type and size limits as proxied uploads, and not
+    already belong to another product.
+    """
+    public_id = data.get('image_public_id')
+    if not public_id:
+        return None
+    # Signed uploads are pinned to UPLOAD_FOLDER, so anything else wasn't ours
+    if not isinstance(public_id, str) or not public_id.startswith(f"{UPLOAD_FOLDER}/"):
+        raise BadRequest("Invalid image public ID")
+
+    other_owner = {'image_public_id': public_id}
+    if item_oid is not None:
+        other_owner['_id'] = {'$ne': item_oid}
+    if collection.find_one(other_owner, projection={'_id': 1}):
+        raise BadRequest("Image is already used by another product")
+
+    try:
+        resource = cloudinary.api.resource(public_id)
+    except cloudinary.exceptions.NotFound:
+        raise BadRequest("Uploaded image not found")
+
+    if resource.get('format') not in ALLOWED_IMAGE_FORMATS or resource.get('bytes', 0) > MAX_IMAGE_SIZE:
+        delete_images_async([public_id])
+        raise BadRequest(f"Image must be {', '.join(ALLOWED_IMAGE_FORMATS)} and under "
+                         f"{MAX_IMAGE_SIZE // (1024 * 1024)}MB")
+    return resource['secure_url'], public_id
+
 def upload_to_cloudinary(file):
     try:
-        # Validate file type and size before upload
+        # Type is sniffed from the file's magic bytes and size is capped while streaming
         if not file.content_type.startswith('image/'):
             raise BadRequest("Only image files are allowed")
-        
-        # Check file size (limit to 10MB)
-        file.seek(0, os.SEEK_END)
-        file_size = file.tell()
-        file.seek(0)
-        if file_size > 10 * 1024 * 1024:  # 10MB
-            raise BadRequest("Image size must be less than 10MB")
-
-        upload_result = cloudinary.uploader.upload(
-            file,
-            folder="faculty_wear",
-            resource_type="image",
-            quality="auto",
-            fetch_format="auto"
+
+        upload_result = cloudinary.uploader.upload_large(
+            file.file,
+            chunk_size=CLOUDINARY_CHUNK_SIZE,
+            folder=UPLOAD_FOLDER,
+            resource_type="image"
         )
-        return upload_result.get('secure_url')
+        return upload_result.get('secure_url'), upload_result.get('public_id')
     except BadRequest as e:
         raise e
     except Exception as e:
         current_app.logger.error(f"Cloudinary upload failed: {str(e)}")
         raise BadRequest("Failed to upload image to Cloudinary")
 
-def delete_from_cloudinary(image_url):
+@faculty_wear_bp.route('/upload-signature', methods=['GET'])
+@requires_admin
+def get_upload_signature():
+    """
+    Sign a direct browser-to-Cloudinary upload so image bytes never pass through this server.
+    The signature pins a fresh public_id and the allowed formats. Cloudinary upload params
+    cannot cap file size, so an upload preset with a size limit is also signed when
+    CLOUDINARY_FACULTY_WEAR_PRESET is set; the size is rechecked when the product is saved.
+    """
     try:
-        if not image_url or 'cloudinary.com' not in image_url:
-            return False
-            
-        # Extract public_id from URL
-        parts = image_url.split('/')
-        folder = parts[-2] if parts[-2] != 'upload' else None
-        public_id = parts[-1].split('.')[0]
-        
-        if folder:
-            public_id = f"{folder}/{public_id}"
-            
-        result = cloudinary.uploader.destroy(public_id)
-        return result.get('result') == 'ok'
+        config = cloudinary.config()
+        params = {
+            'timestamp': int(time.time()),
+            'folder': UPLOAD_FOLDER,
+            'public_id': uuid.uuid4().hex,
+            'allowed_formats': ','.join(ALLOWED_IMAGE_FORMATS)
+        }
+        upload_preset = os.environ.get('CLOUDINARY_FACULTY_WEAR_PRESET')
+        if upload_preset:
+            params['upload_preset'] = upload_preset
+        signature = cloudinary.utils.api_sign_request(params, config.api_secret)
+        return ojsonify({
+            "status": "success",
+            "data": {
+                **params,
+                "signature": signature,
+                "api_key": config.api_key,
+                "cloud_name": config.cloud_name,
+                "upload_url": f"https://api.cloudinary.com/v1_1/{config.cloud_name}/image/upload"
+            }
+        }), 200
     except Exception as e:
-        current_app.logger.error(f"Cloudinary delete failed: {str(e)}")
-        return False
+        current_app.logger.error(f"Error signing upload: {str(e)}")
+        return ojsonify({"status": "error", "message": "Failed to sign upload"}), 500
 
 @faculty_wear_bp.route('/', methods=['GET'])
 def get_all_wear():
     try:
-        items = list(collection.find().sort("created_at", -1))
-        for item in items:
-            item['_id'] = str(item['_id'])
-            item['standard_price'] = float(item['standard_price'])
-            item['custom_price'] = float(item['custom_price'])
-        return jsonify({"status": "success", "data": items}), 200
+        page, page_size = get_page_args()
+
+        cursor = (collection.find({}, projection=LIST_PROJECTION)
+                  .sort("created_at", -1)
+                  .skip((page - 1) * page_size)
+                  .limit(page_size))
+        # Pull the first document here so query errors still surface as a 500
+        first = next(cursor, None)
+
+        def generate():
+            # Encode each document straight onto the response instead of building a list
+            yield dump_json({"status": "success", "page": page, "page_size": page_size})[:-1] + b',"data":['
+            if first is not None:
+                yield dump_json(serialize_wear(first))
+                for item in cursor:
+                    yield b',' + dump_json(serialize_wear(item))
+            yield b']}'
+
+        return current_app.response_class(generate(), status=200, mimetype='application/json')
     except Exception as e:
         current_app.logger.error(f"Error fetching products: {str(e)}")
-        return jsonify({"status": "error", "message": "Failed to fetch products"}), 500
+        return ojsonify({"status": "error", "message": "Failed to fetch products"}), 500
 
 @faculty_wear_bp.route('/<item_id>', methods=['GET'])
 def get_wear(item_id):
     try:
-        if not ObjectId.is_valid(item_id):
-            raise BadRequest("Invalid product ID format")
-            
-        item = collection.find_one({'_id': ObjectId(item_id)})
+        item = collection.find_one({'_id': parse_object_id(item_id, INVALID_ID_MESSAGE)})
         if not item:
             raise NotFound("Product not found")
         
-        item['_id'] = str(item['_id'])
-        item['standard_price'] = float(item['standard_price'])
-        item['custom_price'] = float(item['custom_price'])
-        return jsonify({"status": "success", "data": item}), 200
+        return ojsonify({"status": "success", "data": serialize_wear(item)}), 200
     except NotFound as e:
-        return jsonify({"status": "error", "message": str(e)}), 404
+        return ojsonify({"status": "error", "message": str(e)}), 404
     except BadRequest as e:
-        return jsonify({"status": "error", "message": str(e)}), 400
+        return ojsonify({"status": "error", "message": str(e)}), 400
     except Exception as e:
         current_app.logger.error(f"Error fetching product {item_id}: {str(e)}")
-        return jsonify({"status": "error", "message": "Failed to fetch product"}), 500
+        return ojsonify({"status": "error", "message": "Failed to fetch product"}), 500
 
 @faculty_wear_bp.route('/', methods=['POST'])
 def add_wear():
     try:
         # Initialize variables
         image_url = None
+        image_public_id = None
         file = None
         
         # Check if request is multipart form-data
         if request.content_type.startswith('multipart/form-data'):
-            if 'image_upload' in request.files:
-                file = request.files['image_upload']
-                if file.filename != '':
-                    image_url = upload_to_cloudinary(file)
-            image_url = image_url or request.form.get('image_url', '')
-            data = request.form
+            data, files = parse_multipart_stream(FORM_FIELDS, ('image_upload',))
+            file = files.get('image_upload')
         else:
             # Handle JSON request
             data = request.get_json()
-            image_url = data.get('image_url', '')
-        
-        # Validate required fields
-        required_fields = ['title', 'description', 'standard_price',
-                         'custom_price', 'add_to_cart_text', 'buy_now_text']
-        missing_fields = [field for field in required_fields if not data.get(field)]
-        if missing_fields:
-            raise BadRequest(f"Missing required fields: {', '.join(missing_fields)}")
-        
-        # Validate prices
-        try:
-            standard_price = float(data['standard_price'])
-            custom_price = float(data['custom_price'])
-            if standard_price < 0 or custom_price < 0:
-                raise ValueError("Prices cannot be negative")
-        except ValueError:
-            raise BadRequest("Invalid price format")
+
+        # Validate before uploading so a bad payload never leaves an orphaned image
+        now = datetime.datetime.utcnow()
+        wear = build_wear_fields(data, now)
+
+        if file:
+            image_url, image_public_id = upload_to_cloudinary(file)
+        else:
+            # The browser may already have uploaded directly to Cloudinary
+            image_url, image_public_id = direct_upload_image(data) or (None, None)
 
         # Create product document
-        wear = {
-            "title": data['title'].strip(),
-            "description": data['description'].strip(),
-            "image_url": image_url,
-            "badge_text": data.get('badge_text', '').strip(),
-            "standard_price": standard_price,
-            "custom_price": custom_price,
-            "add_to_cart_text": data['add_to_cart_text'].strip(),
-            "add_to_cart_link": data.get('add_to_cart_link', '#').strip(),
-            "buy_now_text": data['buy_now_text'].strip(),
-            "buy_now_link": data.get('buy_now_link', '#').strip(),
-            "created_at": datetime.datetime.utcnow(),
-            "updated_at": datetime.datetime.utcnow()
-        }
+        wear["image_url"] = image_url or data.get('image_url', '')
+        wear["image_public_id"] = image_public_id
+        wear["created_at"] = now
 
         # Insert into database
         result = collection.insert_one(wear)
-        wear['_id'] = str(result.inserted_id)
+        wear['_id'] = result.inserted_id
         
-        return jsonify({
+        return ojsonify({
             "status": "success", 
             "message": "Product created successfully",
-            "data": wear
+            "data": serialize_wear(wear)
         }), 201
 
     except BadRequest as e:
-        return jsonify({"status": "error", "message": str(e)}), 400
+        return ojsonify({"status": "error", "message": str(e)}), 400
     except Exception as e:
         current_app.logger.error(f"Error creating product: {str(e)}")
-        return jsonify({"status": "error", "message": "Failed to create product"}), 500
+        return ojsonify({"status": "error", "message": "Failed to create product"}), 500
 
 @faculty_wear_bp.route('/<item_id>', methods=['PUT'])
 def update_wear(item_id):
     try:
-        if not ObjectId.is_valid(item_id):
-            raise BadRequest("Invalid product ID format")
-            
-        # Get existing product
-        existing_item = collection.find_one({'_id': ObjectId(item_id)})
-        if not existing_item:
-            raise NotFound("Product not found")
+        oid = parse_object_id(item_id, INVALID_ID_MESSAGE)
+        query = {'_id': oid}
 
         # Initialize variables
-        image_url = existing_item.get('image_url', '')
         file = None
         data = {}
         
         # Check content type
         if request.content_type.startswith('multipart/form-data'):
-            if 'image_upload' in request.files:
-                file = request.files['image_upload']
-                if file.filename != '':
-                    # Delete old image if exists
-                    if existing_item.get('image_url'):
-                        delete_from_cloudinary(existing_item['image_url'])
-                    # Upload new image
-                    image_url = upload_to_cloudinary(file)
-            image_url = image_url or request.form.get('image_url', '')
-            data = request.form
+            data, files = parse_multipart_stream(FORM_FIELDS, ('image_upload',))
+            file = files.get('image_upload')
         else:
             # Handle JSON request
             data = request.get_json()
-            if 'image_url' in data:
-                # Delete old image if it was from Cloudinary
-                if existing_item.get('image_url') and 'cloudinary.com' in existing_item['image_url']:
-                    delete_from_cloudinary(existing_item['image_url'])
-                image_url = data.get('image_url', '')
-        
-        # Validate required fields
-        required_fields = ['title', 'description', 'standard_price',
-                         'custom_price', 'add_to_cart_text', 'buy_now_text']
-        missing_fields = [field for field in required_fields if not data.get(field)]
-        if missing_fields:
-            raise BadRequest(f"Missing required fields: {', '.join(missing_fields)}")
         
-        # Validate prices
-        try:
-            standard_price = float(data['standard_price'])
-            custom_price = float(data['custom_price'])
-            if standard_price < 0 or custom_price < 0:
-                raise ValueError("Prices cannot be negative")
-        except ValueError:
-            raise BadRequest("Invalid price format")
-
         # Prepare updates
-        updates = {
-            "$set": {
-                "title": data['title'].strip(),
-                "description": data['description'].strip(),
-                "image_url": image_url,
-                "badge_text": data.get('badge_text', '').strip(),
-                "standard_price": standard_price,
-                "custom_price": custom_price,
-                "add_to_cart_text": data['add_to_cart_text'].strip(),
-                "add_to_cart_link": data.get('add_to_cart_link', '#').strip(),
-                "buy_now_text": data['buy_now_text'].strip(),
-                "buy_now_link": data.get('buy_now_link', '#').strip(),
-                "updated_at": datetime.datetime.utcnow()
-            }
-        }
+        fields = build_wear_fields(data, datetime.datetime.utcnow())
 
-        # Update database
-        result = collection.update_one(
-            {'_id': ObjectId(item_id)},
-            updates
-        )
+        if file:
+            fields["image_url"], fields["image_public_id"] = upload_to_cloudinary(file)
+        else:
+            direct_upload = direct_upload_image(data, oid)
+            if direct_upload:
+                fields["image_url"], fields["image_public_id"] = direct_upload
 
-        if result.matched_count == 0:
-            raise NotFound("Product not found")
-        
-        # Return updated product
-        item = collection.find_one({'_id': ObjectId(item_id)})
-        item['_id'] = str(item['_id'])
-        item['standard_price'] = float(item['standard_price'])
-        item['custom_price'] = float(item['custom_price'])
+        if "image_public_id" in fields:
+            # New image: swap it in and read back the pre-image in a single round-trip
+            previous = collection.find_one_and_update(
+                query,
+                {"$set": fields},
+                return_document=ReturnDocument.BEFORE
+            )
+            if not previous:
+                delete_images_async([fields["image_public_id"]])
+                raise NotFound("Product not found")
+            if previous.get('image_public_id') != fields["image_public_id"]:
+                delete_images_async([previous.get('image_public_id')])
+            item = {**previous, **fields}
+        else:
+            stale_public_id = None
+            if data.get('image_url') is not None:
+                # A submitted URL needs the stored image to decide whether anything changed
+                existing_item = collection.find_one(query, projection={'image_url': 1, 'image_public_id': 1})
+                if not existing_item:
+                    raise NotFound("Product not found")
+                image_url = existing_item.get('image_url', '')
+                image_public_id = existing_item.get('image_public_id')
+
+                if request.content_type.startswith('multipart/form-data'):
+                    # Form posts only fill in a missing image
+                    if not image_url:
+                        fields["image_url"] = data['image_url']
+                else:
+                    # Only a genuinely different URL replaces the stored image; clients may echo
+                    # back either the stored URL or the delivery URL served on read
+                    unchanged_urls = {image_url}
+                    if image_public_id:
+                        unchanged_urls.add(image_delivery_url(image_public_id))
+                    if data['image_url'] not in unchanged_urls:
+                        fields["image_url"] = data['image_url']
+                        fields["image_public_id"] = None
+                        stale_public_id = image_public_id
+
+            item = collection.find_one_and_update(
+                query,
+                {"$set": fields},
+                return_document=ReturnDocument.AFTER
+            )
+            if not item:
+                raise NotFound("Product not found")
+            delete_images_async([stale_public_id])
         
-        return jsonify({
+        return ojsonify({
             "status": "success", 
             "message": "Product updated successfully",
-            "data": item
+            "data": serialize_wear(item)
         }), 200
 
     except BadRequest as e:
-        return jsonify({"status": "error", "message": str(e)}), 400
+        return ojsonify({"status": "error", "message": str(e)}), 400
     except NotFound as e:
-        return jsonify({"status": "error", "message": str(e)}), 404
+        return ojsonify({"status": "error", "message": str(e)}), 404
     except Exception as e:
         current_app.logger.error(f"Error updating product {item_id}: {str(e)}")
-        return jsonify({"status": "error", "message": "Failed to update product"}), 500
+        return ojsonify({"status": "error", "message": "Failed to update product"}), 500
 
 @faculty_wear_bp.route('/<item_id>', methods=['DELETE'])
 def delete_wear(item_id):
     try:
-        if not ObjectId.is_valid(item_id):
-            raise BadRequest("Invalid product ID format")
-            
-        item = collection.find_one({'_id': ObjectId(item_id)})
+        oid = parse_object_id(item_id, INVALID_ID_MESSAGE)
+
+        # Fetch the image reference and delete in one round-trip
+        item = collection.find_one_and_delete(
+            {'_id': oid},
+            projection={'image_public_id': 1}
+        )
         if not item:
             raise NotFound("Product not found")
-            
-        # Delete image from Cloudinary if it exists
-        if item.get('image_url') and 'cloudinary.com' in item['image_url']:
-            delete_from_cloudinary(item['image_url'])
-        
-        # Delete from database
-        result = collection.delete_one({'_id': ObjectId(item_id)})
-        if result.deleted_count == 0:
-            raise NotFound("Product not found")
-            
-        return jsonify({
+
+        # Delete image from Cloudinary in the background
+        delete_images_async([item.get('image_public_id')])
+
+        return ojsonify({
             "status": "success", 
             "message": "Product deleted successfully"
         }), 200
         
     except NotFound as e:
-        return jsonify({"status": "error", "message": str(e)}), 404
+        return ojsonify({"status": "error", "message": str(e)}), 404
     except BadRequest as e:
-        return jsonify({"status": "error", "message": str(e)}), 400
+        return ojsonify({"status": "error", "message": str(e)}), 400
     except Exception as e:
         current_app.logger.error(f"Error deleting product {item_id}: {str(e)}")
-        return jsonify({"status": "error", "message": "Failed to delete product"}), 500
+        return ojsonify({"status": "error", "message": "Failed to delete product"}), 500
 
-def init_faculty_wear_routes(app, db):
-    global collection
-    collection = db['faculty_wear']
-    
-    # Hardcoded Cloudinary configuration
-    cloudinary.config(
-        cloud_name="dhndd1msa",
-        api_key="337382597786761",
-        api_secret="bEJ0sWFZi8yYzeP5lzVl_rmUtX8",
-        secure=True
-    )
-    
-    # Verify Cloudinary connection
+@faculty_wear_bp.route('/bulk-delete', methods=['POST'])
+@requires_admin
+def bulk_delete_wear():
     try:
-        result = cloudinary.api.ping()
-        if not result.get('status') == 'ok':
-            app.logger.error("Cloudinary ping failed")
-            raise RuntimeError("Failed to verify Cloudinary connection")
-        app.logger.info("Cloudinary connection successful")
+        data = request.get_json(silent=True) or {}
+        item_ids = data.get('ids')
+        if not isinstance(item_ids, list) or not item_ids:
+            raise BadRequest("Expected a non-empty list of product IDs")
+        if len(item_ids) > MAX_BULK_DELETE_IDS:
+            raise BadRequest(f"At most {MAX_BULK_DELETE_IDS} products can be deleted at once")
+
+        query = {'_id': {'$in': [parse_object_id(item_id, INVALID_ID_MESSAGE) for item_id in item_ids]}}
+        items = list(collection.find(query, projection={'image_public_id': 1}))
+        result = collection.delete_many(query)
+
+        delete_images_async([item.get('image_public_id') for item in items])
+
+        return ojsonify({
+            "status": "success",
+            "message": f"Deleted {result.deleted_count} products",
+            "deleted_count": result.deleted_count
+        }), 200
+
+    except BadRequest as e:
+        return ojsonify({"status": "error", "message": str(e)}), 400
     except Exception as e:
-        app.logger.error(f"Cloudinary connection failed: {str(e)}")
-        raise RuntimeError("Failed to connect to Cloudinary")
+        current_app.logger.error(f"Error bulk deleting products: {str(e)}")
+        return ojsonify({"status": "error", "message": "Failed to delete products"}), 500
+
+def init_faculty_wear_routes(app, db):
+    global collection
+    collection = db.get_collection('faculty_wear', codec_options=JSON_CODEC_OPTIONS)
+    collection.create_index([("created_at", -1)])
     
+    configure_cloudinary()
+    # Only ping Cloudinary in development; in production a bad config surfaces on the first upload
+    if os.environ.get('FLASK_ENV') == 'development':
+        verify_cloudinary_async(app)
+
     app.register_blueprint(faculty_wear_bp)
 
@@ -3,7 +3,8 @@ import os
 from datetime import datetime, timedelta, timezone
 from flask import Flask, request, jsonify
 from pymongo import MongoClient
-from werkzeug.security import generate_password_hash, check_password_hash
+from pymongo.errors import DuplicateKeyError
+from werkzeug.security import generate_password_hash
 from dotenv import load_dotenv
 import re
 from flask_cors import CORS
@@ -41,22 +42,37 @@ from faculty_wear import init_faculty_wear_routes
 from sponsored_ads import init_sponsored_ads_module
 
 # Register the users blueprint ✅
-from users import init_users_routes
-from pymongo import MongoClient
-
-client = MongoClient(os.environ.get("MONGO_URI"))
+from users import (
+    init_users_routes, hash_password, verify_password, build_search_blob, SEARCH_BLOB_EXPR
+)
+import atexit
+
+# Single MongoClient shared by every module in this process
+client = MongoClient(
+    os.environ.get("MONGO_URI"),
+    maxPoolSize=max(32, 4 * (os.cpu_count() or 1)),
+    minPoolSize=5,
+    compressors='zstd,zlib',
+    zlibCompressionLevel=3,
+    retryWrites=True,
+    serverSelectionTimeoutMS=2000,
+    socketTimeoutMS=30000,
+    appName="naits_app"
+)
+atexit.register(client.close)
 db = client.get_database()
 
+# Status thresholds in minutes, shared with the users blueprint
 STATUS_CONFIG = {
-    'active': 'Active',
-    'inactive': 'Inactive',
-    'banned': 'Banned'
+    'HEARTBEAT_INTERVAL': 1,
+    'IDLE_THRESHOLD': 3,
+    'OFFLINE_THRESHOLD': 5
 }
 
 init_users_routes(app, db, get_wat_time, STATUS_CONFIG)
 
 init_faculty_wear_routes(app, db)
-init_sponsored_ads_module(app)
+init_sponsored_ads_module(app, db)
 # Enable CORS
 origins = os.environ.get("ALLOWED_ORIGINS").split(",")
 origins = ["https://naits.destinytch.com.ng"]
@@ -98,16 +114,7 @@ JWT_SECRET = os.environ.get('JWT_SECRET')
 JWT_ALGORITHM = 'HS256'
 JWT_EXPIRATION = timedelta(hours=12)
 
-# Status thresholds in minutes
-STATUS_CONFIG = {
-    'HEARTBEAT_INTERVAL': 1,
-    'IDLE_THRESHOLD': 3,
-    'OFFLINE_THRESHOLD': 5
-}
-
 try:
-    mongo_uri = os.environ.get('MONGO_URI')
-    client = MongoClient(mongo_uri, socketTimeoutMS=30000, retryWrites=True, appName="naits_app")
     db = client.get_database('naits_db')
     client.admin.command('ping')
     print("✅ MongoDB connection successful")
@@ -238,7 +245,7 @@ def create_user(data):
         'level': data['level'].upper(),
         'whatsapp': data['whatsapp'],
         'email': data.get('email', '').strip().lower(),
-        'password': generate_password_hash(data['password']),
+        'password': hash_password(data['password']),
         'created_at': get_wat_time(),
         'updated_at': get_wat_time(),
         'last_login': None,
@@ -246,6 +253,7 @@ def create_user(data):
         'last_seen': None,
         'last_notification_check': datetime.min.replace(tzinfo=timezone.utc)
     }
+    user['search_blob'] = build_search_blob(user)
     result = users_collection.insert_one(user)
     return result.inserted_id
 
@@ -262,7 +270,7 @@ def authenticate_user(nickname, department, password):
         'department': department.upper()
     })
     
-    if user and check_password_hash(user['password'], password):
+    if user and verify_password(user, password):
         users_collection.update_one(
             {'_id': user['_id']},
             {'$set': {
@@ -338,7 +346,7 @@ def ensure_admin_exists():
         print("✅ Admin account created")
     else:
         # Update password if it has changed in .env
-        if not check_password_hash(admin['password'], admin_password):
+        if not verify_password(admin, admin_password):
             users_collection.update_one(
                 {'email': admin_email},
                 {'$set': {
@@ -357,10 +365,6 @@ def authenticate_admin(email, password):
     if email.strip().lower() != admin_email.lower():
         return None
     
-    # Verify password matches .env
-    if not check_password_hash(users_collection.find_one({'email': admin_email})['password'], admin_password):
-        return None
-    
     # Get or create admin record
     admin = users_collection.find_one({'email': admin_email})
     
@@ -368,6 +372,10 @@ def authenticate_admin(email, password):
         ensure_admin_exists()
         admin = users_collection.find_one({'email': admin_email})
     
+    # Verify the submitted password against the stored hash
+    if not verify_password(admin, password):
+        return None
+    
     # Update last login
     users_collection.update_one(
         {'_id': admin['_id']},
@@ -433,12 +441,28 @@ def update_user_profile():
             })
             if existing_user:
                 return jsonify({'success': False, 'error': 'Email already in use'}), 400
+
+        # Same check for WhatsApp numbers, which are unique per account
+        if 'whatsapp' in update_data:
+            existing_user = users_collection.find_one({
+                'whatsapp': update_data['whatsapp'],
+                '_id': {'$ne': ObjectId(user_id)}
+            }, {'_id': 1})
+            if existing_user:
+                return jsonify({'success': False, 'error': 'WhatsApp number already in use'}), 400
         
-        # Update in database
-        result = users_collection.update_one(
-            {'_id': ObjectId(user_id)},
-            {'$set': update_data}
-        )
+        # Update in database, rebuilding search_blob from the merged document in the same write
+        try:
+            result = users_collection.update_one(
+                {'_id': ObjectId(user_id)},
+                [
+                    {'$set': {k: {'$literal': v} for k, v in update_data.items()}},
+                    {'$set': {'search_blob': SEARCH_BLOB_EXPR}}
+                ]
+            )
+        except DuplicateKeyError:
+            # Lost a race with another account claiming the same number
+            return jsonify({'success': False, 'error': 'WhatsApp number already in use'}), 400
         
         if result.modified_count == 0:
             return jsonify({'success': False, 'error': 'No changes made'}), 400
@@ -681,14 +705,18 @@ def change_password():
             return jsonify({'success': False, 'error': 'User not found'}), 404
             
         # Verify current password
-        if not check_password_hash(user['password'], data['current_password']):
+        if not verify_password(user, data['current_password']):
             return jsonify({'success': False, 'error': 'Current password is incorrect'}), 401
             
-        # Update password
+        # Update password; the admin account stays on werkzeug hashes
+        if user.get('role') == 'admin':
+            new_hash = generate_password_hash(data['new_password'])
+        else:
+            new_hash = hash_password(data['new_password'])
         users_collection.update_one(
             {'_id': ObjectId(user_id)},
             {'$set': {
-                'password': generate_password_hash(data['new_password']),
+                'password': new_hash,
                 'updated_at': get_wat_time()
             }}
         )
@@ -9,16 +9,13 @@ from io import BytesIO
 import os
 from werkzeug.utils import secure_filename
 from extensions import db
+from uploads import configure_cloudinary
 print("✅ resources module initialized")
 resources_bp = Blueprint('resources_bp', __name__, url_prefix='/api/resources')
 resources_collection = db.resources
 
-# Cloudinary config (⚠️ Use environment variables in production)
-cloudinary.config(
-    cloud_name="dhndd1msa",
-    api_key="337382597786761",
-    api_secret="bEJ0sWFZi8yYzeP5lzVl_rmUtX8"
-)
+# Shared Cloudinary config (configured once per process)
+configure_cloudinary()
 
 # Helper to serialize MongoDB _id
 def serialize_resource(res):
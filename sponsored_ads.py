@@ -1,65 +1,94 @@
-from datetime import datetime, timedelta
-from flask import Blueprint, request, jsonify
-from pymongo import MongoClient
-from bson import ObjectId
+from datetime import datetime, timedelta, timezone
+from flask import Blueprint, request, current_app
+from werkzeug.exceptions import BadRequest
 import os
-from dotenv import load_dotenv
+import time
 import cloudinary
 import cloudinary.uploader
-import cloudinary.api
+from extensions import (JSON_CODEC_OPTIONS, cache, dump_json, ojsonify, parse_object_id,
+                        get_page_args, MAX_BULK_DELETE_IDS)
+from users import requires_admin
+from uploads import (parse_multipart_stream, configure_cloudinary, delete_images_async,
+                     upload_executor, CLOUDINARY_CHUNK_SIZE)
 print("✅ Sponsored ads module initialized")
-# Load environment variables
-load_dotenv()
-
-# Configure Cloudinary
-cloudinary.config(
-    cloud_name=os.environ.get('CLOUDINARY_CLOUD_NAME'),
-    api_key=os.environ.get('CLOUDINARY_API_KEY'),
-    api_secret=os.environ.get('CLOUDINARY_API_SECRET')
-)
 
 # Create Blueprint
 sponsored_ads_bp = Blueprint('sponsored_ads', __name__)
 
-# MongoDB setup
-client = MongoClient(os.environ.get("MONGO_URI"))
-db = client.get_database()
-ads_collection = db.sponsored_ads
+# Set by init_sponsored_ads_module from the app's shared database
+ads_collection = None
+
+AD_FORM_FIELDS = ('title', 'description', 'sponsor_name', 'whatsapp_number', 'duration_days')
+PUBLIC_AD_PROJECTION = {'sponsor_logo_public_id': 0, 'ad_image_public_id': 0}
+IMAGE_ID_PROJECTION = {'sponsor_logo_public_id': 1, 'ad_image_public_id': 1}
+EXPIRED_AD_PROJECTION = {'title': 1, 'sponsor_name': 1, 'expires_at': 1, 'created_at': 1}
+# Upper bound on staleness for workers that did not see a write when running without Redis
+ACTIVE_ADS_CACHE_TIMEOUT = 30  # seconds
+ACTIVE_ADS_VERSION_KEY = 'active_ads:version'
+AD_IMAGE_FOLDERS = {'sponsor_logo': 'sponsored_ads/logos', 'ad_image': 'sponsored_ads/images'}
+# Thumbnails Cloudinary derives in the background after upload
+AD_EAGER_TRANSFORMS = [{'width': 400, 'crop': 'limit', 'fetch_format': 'auto', 'quality': 'auto'}]
+
+def active_ads_cache_key(page, page_size):
+    version = cache.get(ACTIVE_ADS_VERSION_KEY) or 0
+    return f'active_ads:{version}:{page}:{page_size}'
 
-def get_wat_time():
-    """Get current time in WAT (UTC+1)"""
-    return datetime.utcnow() + timedelta(hours=1)
+def invalidate_active_ads():
+    """
+    Bump the version so every cached page of active ads is bypassed. This reaches all workers
+    only with the shared Redis cache; under the per-process SimpleCache fallback, other workers
+    keep serving their cached pages for up to ACTIVE_ADS_CACHE_TIMEOUT.
+    """
+    cache.set(ACTIVE_ADS_VERSION_KEY, time.time_ns(), timeout=0)
+
+def upload_ad_image(field, file):
+    return cloudinary.uploader.upload_large(
+        file.file,
+        chunk_size=CLOUDINARY_CHUNK_SIZE,
+        folder=AD_IMAGE_FOLDERS[field],
+        resource_type="image",
+        eager=AD_EAGER_TRANSFORMS,
+        eager_async=True,
+        eager_notification_url=os.environ.get('CLOUDINARY_NOTIFICATION_URL')
+    )
 
 @sponsored_ads_bp.route('/api/admin/sponsored-ads', methods=['POST'])
 def create_sponsored_ad():
     try:
         # Get form data
-        title = request.form.get('title')
-        description = request.form.get('description')
-        sponsor_name = request.form.get('sponsor_name')
-        whatsapp_number = request.form.get('whatsapp_number')
-        duration_days = int(request.form.get('duration_days', 7))  # Default 7 days
-        sponsor_logo = request.files.get('sponsor_logo')
-        ad_image = request.files.get('ad_image')
+        form, files = parse_multipart_stream(AD_FORM_FIELDS, tuple(AD_IMAGE_FOLDERS))
+        title = form.get('title')
+        description = form.get('description')
+        sponsor_name = form.get('sponsor_name')
+        whatsapp_number = form.get('whatsapp_number')
+        duration_days = int(form.get('duration_days', 7))  # Default 7 days
 
         # Validate required fields
         if not all([title, description, sponsor_name, whatsapp_number]):
-            return jsonify({'success': False, 'error': 'Missing required fields'}), 400
+            return ojsonify({'success': False, 'error': 'Missing required fields'}), 400
 
-        # Upload images to Cloudinary
+        # Upload images to Cloudinary concurrently
+        futures = {field: upload_executor.submit(upload_ad_image, field, file)
+                   for field, file in files.items()}
         upload_results = {}
-        if sponsor_logo:
-            logo_upload = cloudinary.uploader.upload(sponsor_logo, folder="sponsored_ads/logos")
-            upload_results['sponsor_logo_url'] = logo_upload['secure_url']
-            upload_results['sponsor_logo_public_id'] = logo_upload['public_id']
+        errors = []
+        for field, future in futures.items():
+            try:
+                upload = future.result()
+            except Exception as e:
+                errors.append(e)
+                continue
+            upload_results[f'{field}_url'] = upload['secure_url']
+            upload_results[f'{field}_public_id'] = upload['public_id']
 
-        if ad_image:
-            image_upload = cloudinary.uploader.upload(ad_image, folder="sponsored_ads/images")
-            upload_results['ad_image_url'] = image_upload['secure_url']
-            upload_results['ad_image_public_id'] = image_upload['public_id']
+        if errors:
+            # Don't leave the sibling upload orphaned when one of them failed
+            delete_images_async([upload_results.get(f'{field}_public_id') for field in futures])
+            raise errors[0]
 
         # Calculate expiration time
-        created_at = get_wat_time()
+        # Stored as true UTC; clients render in WAT
+        created_at = datetime.now(timezone.utc)
         expires_at = created_at + timedelta(days=duration_days)
 
         # Create ad document
@@ -70,144 +99,180 @@ def create_sponsored_ad():
             'whatsapp_number': whatsapp_number,
             'created_at': created_at,
             'expires_at': expires_at,
-            'is_active': True,
             **upload_results
         }
 
         # Insert into database
         result = ads_collection.insert_one(ad_data)
-        ad_id = str(result.inserted_id)
+        ad_id = result.inserted_id
+        invalidate_active_ads()
 
-        return jsonify({
+        return ojsonify({
             'success': True,
             'message': 'Sponsored ad created successfully',
             'ad_id': ad_id
         }), 201
 
+    except BadRequest as e:
+        return ojsonify({'success': False, 'error': e.description}), 400
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return ojsonify({'success': False, 'error': str(e)}), 500
 
 @sponsored_ads_bp.route('/api/sponsored-ads', methods=['GET'])
 def get_active_ads():
     try:
-        current_time = get_wat_time()
-        
-        # Find active ads that haven't expired
-        active_ads = list(ads_collection.find({
-            'is_active': True,
-            'expires_at': {'$gt': current_time}
-        }).sort('created_at', -1))
-
-        # Convert ObjectId to string and format response
-        ads_list = []
-        for ad in active_ads:
-            ad['_id'] = str(ad['_id'])
-            ads_list.append(ad)
-
-        return jsonify({
-            'success': True,
-            'ads': ads_list
-        }), 200
+        page, page_size = get_page_args()
+        cache_key = active_ads_cache_key(page, page_size)
+
+        # Cache the serialized body so repeat hits skip both MongoDB and JSON encoding
+        body = cache.get(cache_key)
+        if body is None:
+            current_time = datetime.now(timezone.utc)
+
+            # An ad is active until it expires (_id is decoded to str by JSON_CODEC_OPTIONS)
+            active_ads = list(ads_collection.find({
+                'expires_at': {'$gt': current_time}
+            }, projection=PUBLIC_AD_PROJECTION)
+                .sort('created_at', -1)
+                .skip((page - 1) * page_size)
+                .limit(page_size))
+
+            body = dump_json({
+                'success': True,
+                'ads': active_ads,
+                'page': page,
+                'page_size': page_size
+            })
+            cache.set(cache_key, body, timeout=ACTIVE_ADS_CACHE_TIMEOUT)
+
+        response = current_app.response_class(body, mimetype='application/json')
+        response.add_etag()
+        response.cache_control.max_age = ACTIVE_ADS_CACHE_TIMEOUT
+        return response.make_conditional(request)
 
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return ojsonify({'success': False, 'error': str(e)}), 500
 
 @sponsored_ads_bp.route('/api/admin/sponsored-ads/<ad_id>', methods=['DELETE'])
 def delete_ad(ad_id):
     try:
-        # First try to delete images from Cloudinary
-        ad = ads_collection.find_one({'_id': ObjectId(ad_id)})
+        oid = parse_object_id(ad_id)
+        if oid is None:
+            return ojsonify({'success': False, 'error': 'Invalid ad ID format'}), 400
+
+        # Delete from database, getting the image ids back in the same round-trip
+        ad = ads_collection.find_one_and_delete({'_id': oid}, projection=IMAGE_ID_PROJECTION)
         if not ad:
-            return jsonify({'success': False, 'error': 'Ad not found'}), 404
+            return ojsonify({'success': False, 'error': 'Ad not found'}), 404
 
-        # Delete images from Cloudinary if they exist
-        if 'sponsor_logo_public_id' in ad:
-            cloudinary.uploader.destroy(ad['sponsor_logo_public_id'])
-        if 'ad_image_public_id' in ad:
-            cloudinary.uploader.destroy(ad['ad_image_public_id'])
+        invalidate_active_ads()
 
-        # Delete from database
-        ads_collection.delete_one({'_id': ObjectId(ad_id)})
+        # Delete images from Cloudinary in the background
+        delete_images_async([ad.get('sponsor_logo_public_id'), ad.get('ad_image_public_id')])
 
-        return jsonify({
+        return ojsonify({
             'success': True,
             'message': 'Ad deleted successfully'
         }), 200
 
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return ojsonify({'success': False, 'error': str(e)}), 500
 
-def check_expired_ads():
-    """Background task to deactivate expired ads"""
+@sponsored_ads_bp.route('/api/admin/sponsored-ads/bulk-delete', methods=['POST'])
+@requires_admin
+def bulk_delete_ads():
     try:
-        current_time = get_wat_time()
-        
-        # Find and deactivate expired ads
-        result = ads_collection.update_many(
-            {
-                'expires_at': {'$lte': current_time},
-                'is_active': True
-            },
-            {'$set': {'is_active': False}}
-        )
-        
-        if result.modified_count > 0:
-            print(f"Deactivated {result.modified_count} expired ads")
-            
+        data = request.get_json(silent=True) or {}
+        ad_ids = data.get('ids')
+        if not isinstance(ad_ids, list) or not ad_ids:
+            return ojsonify({'success': False, 'error': 'Expected a non-empty list of ad IDs'}), 400
+        if len(ad_ids) > MAX_BULK_DELETE_IDS:
+            return ojsonify({'success': False,
+                             'error': f'At most {MAX_BULK_DELETE_IDS} ads can be deleted at once'}), 400
+
+        oids = [parse_object_id(ad_id) for ad_id in ad_ids]
+        if None in oids:
+            return ojsonify({'success': False, 'error': 'Invalid ad ID format'}), 400
+
+        query = {'_id': {'$in': oids}}
+        ads = list(ads_collection.find(query, projection=IMAGE_ID_PROJECTION))
+        result = ads_collection.delete_many(query)
+        invalidate_active_ads()
+
+        public_ids = []
+        for ad in ads:
+            public_ids.extend([ad.get('sponsor_logo_public_id'), ad.get('ad_image_public_id')])
+        delete_images_async(public_ids)
+
+        return ojsonify({
+            'success': True,
+            'message': f'Deleted {result.deleted_count} ads',
+            'deleted_count': result.deleted_count
+        }), 200
+
     except Exception as e:
-        print(f"Error in ad expiration check: {str(e)}")
+        return ojsonify({'success': False, 'error': str(e)}), 500
 
-def init_sponsored_ads_module(app):
+def init_sponsored_ads_module(app, db):
     """Initialize the sponsored ads module"""
+    global ads_collection
+    ads_collection = db.get_collection('sponsored_ads', codec_options=JSON_CODEC_OPTIONS)
+    configure_cloudinary()
+
     # Register blueprint
     app.register_blueprint(sponsored_ads_bp, url_prefix='/')
     
-    # Create index for expiration
-    ads_collection.create_index([("expires_at", 1)])
-    ads_collection.create_index([("is_active", 1)])
+    # Serves the active-ads expires_at filter as well as the filter and sort of the admin
+    # expired view, so no separate single-field expires_at index is needed
+    ads_collection.create_index([("expires_at", -1), ("created_at", -1)])
     
 @sponsored_ads_bp.route('/api/admin/sponsored-ads/expired', methods=['GET'])
 def get_expired_ads():
     try:
-        current_time = get_wat_time()
+        current_time = datetime.now(timezone.utc)
+        page, page_size = get_page_args()
         expired_ads = list(ads_collection.find({
             'expires_at': {'$lte': current_time}
-        }).sort('created_at', -1))
+        }, projection=EXPIRED_AD_PROJECTION)
+            .sort([('expires_at', -1), ('created_at', -1)])
+            .skip((page - 1) * page_size)
+            .limit(page_size))
 
-        for ad in expired_ads:
-            ad['_id'] = str(ad['_id'])
-
-        return jsonify({
+        return ojsonify({
             'success': True,
-            'ads': expired_ads
+            'ads': expired_ads,
+            'page': page,
+            'page_size': page_size
         }), 200
     except Exception as e:
-        return jsonify({
+        return ojsonify({
             'success': False,
             'error': str(e)
         }), 500
 @sponsored_ads_bp.route('/api/admin/sponsored-ads/<ad_id>/extend', methods=['POST'])
 def extend_ad(ad_id):
     try:
-        ad = ads_collection.find_one({'_id': ObjectId(ad_id)})
+        oid = parse_object_id(ad_id)
+        if oid is None:
+            return ojsonify({'success': False, 'error': 'Invalid ad ID format'}), 400
+
+        ad = ads_collection.find_one({'_id': oid})
         if not ad:
-            return jsonify({'success': False, 'error': 'Ad not found'}), 404
+            return ojsonify({'success': False, 'error': 'Ad not found'}), 404
 
         new_expires_at = ad['expires_at'] + timedelta(days=7)
         ads_collection.update_one(
-            {'_id': ObjectId(ad_id)},
-            {'$set': {
-                'expires_at': new_expires_at,
-                'is_active': True
-            }}
+            {'_id': oid},
+            {'$set': {'expires_at': new_expires_at}}
         )
+        invalidate_active_ads()
 
-        return jsonify({
+        return ojsonify({
             'success': True,
             'message': 'Ad extended successfully'
         }), 200
     except Exception as e:
-        return jsonify({
+        return ojsonify({
             'success': False,
             'error': str(e)
         }), 500
@@ -0,0 +1,164 @@
+import functools
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import cloudinary
+import cloudinary.api
+from flask import request
+from streaming_form_data import StreamingFormDataParser
+from streaming_form_data.parser import ParseFailedException
+from streaming_form_data.targets import BaseTarget, ValueTarget
+from werkzeug.exceptions import BadRequest
+
+READ_CHUNK_SIZE = 64 * 1024
+MAX_IMAGE_SIZE = 10 * 1024 * 1024  # 10MB
+CLOUDINARY_CHUNK_SIZE = 6_000_000
+CLOUDINARY_BULK_DELETE_LIMIT = 100  # Admin API cap per delete_resources call
+MAX_FORM_OVERHEAD = 1024 * 1024  # Allowance for text fields and multipart boundaries
+SNIFF_SIZE = 16
+# Cloudinary format names for the types sniff_image_type accepts
+ALLOWED_IMAGE_FORMATS = ('jpg', 'png', 'webp', 'gif')
+
+
+def sniff_image_type(head):
+    """Identify JPEG/PNG/WebP/GIF from the leading bytes; returns a MIME type or None"""
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'image/jpeg'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'image/png'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    if head.startswith((b'GIF87a', b'GIF89a')):
+        return 'image/gif'
+    return None
+
+@functools.lru_cache(maxsize=1)
+def configure_cloudinary():
+    """Configure the Cloudinary SDK once per process and return the shared config"""
+    cloudinary.config(
+        cloud_name=os.environ.get('CLOUDINARY_CLOUD_NAME'),
+        api_key=os.environ.get('CLOUDINARY_API_KEY'),
+        api_secret=os.environ.get('CLOUDINARY_API_SECRET'),
+        secure=True
+    )
+    return cloudinary.config()
+
+
+def verify_cloudinary_async(app):
+    """Ping Cloudinary on a background thread so worker startup never waits on it"""
+    def ping():
+        try:
+            result = cloudinary.api.ping()
+            if result.get('status') == 'ok':
+                app.logger.info("Cloudinary connection successful")
+            else:
+                app.logger.error("Cloudinary ping failed")
+        except Exception as e:
+            app.logger.error(f"Cloudinary connection failed: {str(e)}")
+
+    threading.Thread(target=ping, daemon=True).start()
+
+
+# Lets independent uploads in one request overlap on the network
+upload_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='cloudinary-upload')
+
+# Image cleanup runs off the request thread so deletes respond immediately
+cleanup_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='cloudinary-cleanup')
+
+
+def _delete_images(public_ids):
+    for start in range(0, len(public_ids), CLOUDINARY_BULK_DELETE_LIMIT):
+        batch = public_ids[start:start + CLOUDINARY_BULK_DELETE_LIMIT]
+        try:
+            cloudinary.api.delete_resources(batch, invalidate=True)
+        except Exception as e:
+            print(f"Cloudinary bulk delete failed: {str(e)}")
+
+
+def delete_images_async(public_ids):
+    """Queue Cloudinary assets for deletion in batches of up to 100 per API call"""
+    public_ids = [public_id for public_id in public_ids if public_id]
+    if public_ids:
+        cleanup_executor.submit(_delete_images, public_ids)
+
+
+class UploadTarget(BaseTarget):
+    """
+    Spool an uploaded image while counting bytes. The leading bytes are sniffed as they
+    arrive, so non-images and files over max_size are rejected without buffering the rest.
+    """
+
+    def __init__(self, max_size=MAX_IMAGE_SIZE):
+        super().__init__()
+        self.max_size = max_size
+        self.size = 0
+        self.head = b''
+        self.image_type = None
+        self.file = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+
+    def on_data_received(self, chunk):
+        self.size += len(chunk)
+        if self.size > self.max_size:
+            raise BadRequest(f"Image size must be less than {self.max_size // (1024 * 1024)}MB")
+
+        if self.image_type is None:
+            self.head += chunk[:SNIFF_SIZE - len(self.head)]
+            if len(self.head) >= SNIFF_SIZE:
+                self._check_image_type()
+
+        self.file.write(chunk)
+
+    def on_finish(self):
+        if self.size and self.image_type is None:
+            self._check_image_type()
+        self.file.seek(0)
+
+    def _check_image_type(self):
+        self.image_type = sniff_image_type(self.head)
+        if self.image_type is None:
+            raise BadRequest("Only image files are allowed")
+
+    @property
+    def filename(self):
+        return self.multipart_filename or ''
+
+    @property
+    def content_type(self):
+        # Sniffed from the bytes rather than trusting the client's multipart header
+        return self.image_type or ''
+
+
+def parse_multipart_stream(field_names, file_fields):
+    """
+    Parse a multipart body straight off request.stream without Werkzeug's form parser.
+    Returns (form, files): form maps each received text field to its value and files maps
+    each received file field to its UploadTarget.
+    """
+    if request.mimetype != 'multipart/form-data':
+        raise BadRequest("Expected a multipart/form-data request")
+
+    # Reject oversized bodies from the Content-Length header before reading a byte
+    max_body = MAX_IMAGE_SIZE * len(file_fields) + MAX_FORM_OVERHEAD
+    if request.content_length and request.content_length > max_body:
+        raise BadRequest(f"Image size must be less than {MAX_IMAGE_SIZE // (1024 * 1024)}MB")
+
+    try:
+        parser = StreamingFormDataParser(headers={'Content-Type': request.content_type})
+
+        values = {name: ValueTarget() for name in field_names}
+        uploads = {name: UploadTarget() for name in file_fields}
+        for name, target in {**values, **uploads}.items():
+            parser.register(name, target)
+
+        while True:
+            chunk = request.stream.read(READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            parser.data_received(chunk)
+    except ParseFailedException:
+        raise BadRequest("Malformed multipart/form-data body")
+
+    form = {name: target.value.decode('utf-8') for name, target in values.items() if target.value}
+    files = {name: target for name, target in uploads.items() if target.filename}
+    return form, files
@@ -1,47 +1,174 @@
-from flask import Blueprint, request, jsonify, current_app
-from bson import ObjectId
-from werkzeug.security import generate_password_hash, check_password_hash
+from flask import Blueprint, request, current_app, g
+from werkzeug.security import check_password_hash
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerificationError
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
+from operator import itemgetter
+from pymongo import ReturnDocument, WriteConcern
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 from flask_jwt_extended import decode_token
+from cachetools import TTLCache
+from extensions import ojsonify, parse_object_id, get_page_args
+import base64
+import hashlib
+import hmac
 import jwt
+import orjson
 import os
 import re
+import threading
+import time
 
 # Blueprint setup
 users_bp = Blueprint('users', __name__)
 
 # Globals to be set by init_users_routes
 users_collection = None
+status_collection = None
 get_wat_time = None
 STATUS_CONFIG = None
 SECRET_KEY = os.getenv('JWT_SECRET', 'dev-secret')  # Override in production
 
+# Argon2id with OWASP parameters (m=46 MiB, t=1, p=1); one shared, thread-safe instance
+ph = PasswordHasher(time_cost=1, memory_cost=46 * 1024, parallelism=1)
+
+# Each concurrent Argon2 hash holds 46 MiB, so bulk hashing is capped at 4 threads
+MAX_HASH_WORKERS = min(os.cpu_count() or 1, 4)
+
+# One decoder with fixed options, reused for every request
+_jwt = jwt.PyJWT(options={'require': ['exp', 'user_id'], 'verify_signature': True})
+
+# Signin tokens are always HS256, so the header segment and keyed HMAC state are built once
+_HEADER_B64 = base64.urlsafe_b64encode(b'{"alg":"HS256","typ":"JWT"}').rstrip(b'=')
+_HMAC_BASE = hmac.new(SECRET_KEY.encode(), digestmod=hashlib.sha256)
+_EXP_DELTA_SECONDS = 2 * 60 * 60
+
+# Verified token payloads, so repeat requests with the same token skip the HMAC check
+_token_cache = TTLCache(maxsize=4096, ttl=60)
+_token_cache_lock = threading.Lock()
+
+# Fields folded into the lowercase search_blob that backs the get_users text index
+SEARCH_FIELDS = ('first_name', 'last_name', 'nickname', 'email')
+
+# Server-side equivalent of build_search_blob, for pipeline updates and backfills
+SEARCH_BLOB_EXPR = {'$toLower': {'$trim': {'input': {'$concat': [
+    part
+    for index, field in enumerate(SEARCH_FIELDS)
+    for part in ([' '] if index else []) + [{'$ifNull': [f'${field}', '']}]
+]}}}}
+
+
+# Fields returned by sanitize_user_data; list queries project to exactly these
+_USER_FIELDS = ('first_name', 'last_name', 'nickname', 'department', 'level')
+_OPTIONAL_USER_FIELDS = ('email', 'whatsapp', 'last_login', 'status', 'updated_at')
+_get_user_fields = itemgetter(*_USER_FIELDS)
+_LIST_PROJECTION = dict.fromkeys(_USER_FIELDS + _OPTIONAL_USER_FIELDS, 1)
+# Signin additionally needs the hash to verify against, and the role verify_password checks
+_AUTH_PROJECTION = {**_LIST_PROJECTION, 'password': 1, 'role': 1}
+
+# Stored timestamps are WAT-shifted (see get_wat_time); WAT is UTC+1 with no DST.
+# _WAT_NOW lets MongoDB stamp the same value from its own clock.
+WAT_OFFSET_MS = 60 * 60 * 1000
+_WAT_NOW = {'$add': ['$$NOW', WAT_OFFSET_MS]}
+_WAT = timezone(timedelta(milliseconds=WAT_OFFSET_MS), 'WAT')
+
+# Signup validation, built once rather than per call
+_REQUIRED_FIELDS = (
+    ('first_name', 'First name is required'),
+    ('last_name', 'Last name is required'),
+    ('birthday', 'Birthday is required (MM-DD format)'),
+    ('nickname', 'Nickname is required'),
+    ('department', 'Department is required'),
+    ('level', 'Level is required'),
+    ('whatsapp', 'WhatsApp number is required (11 digits)'),
+    ('password', 'Password is required (min 10 characters)'),
+)
+_BIRTHDAY_RE = re.compile(r'^\d{2}-\d{2}$')
+
 
 # ========== Initializer ==========
 def init_users_routes(app, db, wat_time_func, status_config):
-    global users_collection, get_wat_time, STATUS_CONFIG
+    """
+    db should come from the process-wide MongoClient in naits.py, which is built with
+    compressors='zstd,zlib', zlibCompressionLevel=3, maxPoolSize=max(32, 4 * cpu_count) and
+    retryWrites=True; get_users pages and bulk inserts are the largest payloads on the wire.
+    """
+    global users_collection, status_collection, get_wat_time, STATUS_CONFIG
     users_collection = db.users
+    # Derived status is recomputed every sweep, so its writes skip the journal wait
+    status_collection = users_collection.with_options(write_concern=WriteConcern(w=1, j=False))
     get_wat_time = wat_time_func
+
+    # The unique nickname and whatsapp indexes are built by backfill_search_blob.py and
+    # dedupe_whatsapp.py once existing data has been checked for duplicates. Index builds here
+    # must not stop the app from starting when MongoDB is unreachable; requests then fail
+    # individually instead.
+    try:
+        users_collection.create_index([('search_blob', 'text')])
+        # check_user_status sweeps by status and a last_active cutoff
+        users_collection.create_index([('status', 1), ('last_active', 1)], name='status_lastactive_idx')
+    except Exception as e:
+        app.logger.error(f"Failed to create users indexes: {str(e)}")
     STATUS_CONFIG = status_config
     app.register_blueprint(users_bp)
 
 from functools import wraps
-from flask import request, jsonify
+from flask import request
+
+def decode_auth_token(token):
+    """Verify a JWT, serving repeat tokens from the TTL cache until their own exp passes"""
+    with _token_cache_lock:
+        decoded = _token_cache.get(token)
+
+    if decoded is None:
+        decoded = _jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
+        with _token_cache_lock:
+            _token_cache[token] = decoded
+    elif decoded['exp'] <= time.time():
+        raise jwt.ExpiredSignatureError('Signature has expired')
+
+    return decoded
+
+def _sign_hs256(payload):
+    """Encode and sign a JWT; equivalent to jwt.encode(payload, SECRET_KEY, algorithm='HS256')"""
+    signing_input = _HEADER_B64 + b'.' + base64.urlsafe_b64encode(orjson.dumps(payload)).rstrip(b'=')
+    mac = _HMAC_BASE.copy()
+    mac.update(signing_input)
+    signature = base64.urlsafe_b64encode(mac.digest()).rstrip(b'=')
+    return (signing_input + b'.' + signature).decode()
 
 def requires_auth(f):
     @wraps(f)
     def decorated(*args, **kwargs):
-        token = request.headers.get('Authorization', '').replace('Bearer ', '')
+        token = request.headers.get('Authorization', '')
+        if token.startswith('Bearer '):
+            token = token[7:]
         if not token:
-            return jsonify({'success': False, 'error': 'Token missing'}), 401
+            return ojsonify({'success': False, 'error': 'Token missing'}), 401
         try:
-            decoded = jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
+            decoded = decode_auth_token(token)
             request.user_id = decoded['user_id']
+            # Parsed once here so handlers reuse it instead of re-parsing user_id
+            g.user_oid = parse_object_id(request.user_id)
+            if g.user_oid is None:
+                return ojsonify({'success': False, 'error': 'Invalid token'}), 401
             return f(*args, **kwargs)
         except jwt.ExpiredSignatureError:
-            return jsonify({'success': False, 'error': 'Token expired'}), 401
+            return ojsonify({'success': False, 'error': 'Token expired'}), 401
         except jwt.InvalidTokenError:
-            return jsonify({'success': False, 'error': 'Invalid token'}), 401
+            return ojsonify({'success': False, 'error': 'Invalid token'}), 401
+    return decorated
+
+def requires_admin(f):
+    """requires_auth, plus a check that the token belongs to the admin account"""
+    @wraps(f)
+    @requires_auth
+    def decorated(*args, **kwargs):
+        user = users_collection.find_one({'_id': g.user_oid}, {'role': 1})
+        if not user or user.get('role') != 'admin':
+            return ojsonify({'success': False, 'error': 'Admin access required'}), 403
+        return f(*args, **kwargs)
     return decorated
 
 
@@ -49,45 +176,101 @@ def requires_auth(f):
 
 # ========== Helpers ==========
 def sanitize_user_data(user):
+    first_name, last_name, nickname, department, level = _get_user_fields(user)
     return {
         'id': str(user['_id']),
-        'first_name': user['first_name'],
-        'last_name': user['last_name'],
-        'nickname': user['nickname'],
-        'department': user['department'],
-        'level': user['level'],
+        'first_name': first_name,
+        'last_name': last_name,
+        'nickname': nickname,
+        'department': department,
+        'level': level,
         'email': user.get('email', ''),
         'whatsapp': user.get('whatsapp', ''),
-        'last_login': user.get('last_login'),
+        'last_login': _to_wat_iso(user.get('last_login')),
         'status': user.get('status', 'active'),
-        'updated_at': user.get('updated_at')
+        'updated_at': _to_wat_iso(user.get('updated_at'))
     }
 
 
-def validate_signup_data(data):
-    errors = []
-    required_fields = {
-        'first_name': 'First name is required',
-        'last_name': 'Last name is required',
-        'birthday': 'Birthday is required (MM-DD format)',
-        'nickname': 'Nickname is required',
-        'department': 'Department is required',
-        'level': 'Level is required',
-        'whatsapp': 'WhatsApp number is required (11 digits)',
-        'password': 'Password is required (min 10 characters)'
-    }
+def _to_wat_iso(value):
+    """Format a stored WAT-shifted timestamp as ISO 8601 with its +01:00 offset"""
+    return value.replace(tzinfo=_WAT).isoformat() if value else None
+
+
+def build_search_blob(user):
+    return ' '.join(user.get(field) or '' for field in SEARCH_FIELDS).strip().lower()
+
+
+def hash_password(password):
+    return ph.hash(password)
+
+
+def verify_password(user, password):
+    """
+    Check a password against the user's stored hash, returning False for unrecognised hashes.
+    Legacy werkzeug hashes (pbkdf2:/scrypt:) and Argon2 hashes with outdated parameters are
+    rehashed in place on a successful match. The admin account keeps its werkzeug hash, which
+    ensure_admin_exists manages from the environment.
+    """
+    stored = user.get('password') or ''
+
+    if stored.startswith('$argon2'):
+        try:
+            ph.verify(stored, password)
+        except (VerificationError, InvalidHashError):
+            return False
+        needs_rehash = ph.check_needs_rehash(stored)
+    else:
+        try:
+            if not check_password_hash(stored, password):
+                return False
+        except ValueError:
+            # werkzeug raises on hash formats it does not know
+            return False
+        needs_rehash = True
+
+    if user.get('role') == 'admin':
+        needs_rehash = False
+
+    if needs_rehash:
+        users_collection.update_one(
+            {'_id': user['_id']},
+            {'$set': {'password': hash_password(password)}}
+        )
+    return True
 
-    for field, message in required_fields.items():
+
+def _is_11_digits(value):
+    # str.isdigit scans in C and beats both regex and a pure-Python SWAR word test;
+    # isascii keeps out non-ASCII digits such as '٠' that isdigit would accept
+    return len(value) == 11 and value.isascii() and value.isdigit()
+
+
+def validate_signup_data(data, errors=None):
+    """
+    Return the list of validation messages for a signup payload. Callers validating many
+    rows can pass one errors list to be cleared and refilled in place instead of allocating
+    a new list per row.
+    """
+    if errors is None:
+        errors = []
+    else:
+        errors.clear()
+
+    for field, message in _REQUIRED_FIELDS:
         if not data.get(field):
             errors.append(message)
 
-    if data.get('birthday') and not re.match(r'^\d{2}-\d{2}$', data['birthday']):
+    birthday = data.get('birthday')
+    if birthday and not _BIRTHDAY_RE.match(birthday):
         errors.append('Birthday must be in MM-DD format')
 
-    if data.get('whatsapp') and not re.match(r'^\d{11}$', data['whatsapp']):
+    whatsapp = data.get('whatsapp')
+    if whatsapp and not _is_11_digits(whatsapp):
         errors.append('WhatsApp number must be 11 digits')
 
-    if data.get('password') and len(data['password']) < 10:
+    password = data.get('password')
+    if password and len(password) < 10:
         errors.append('Password must be at least 10 characters')
 
     return errors
@@ -100,8 +283,7 @@ def user_exists(nickname, whatsapp):
         ]
     })
 
-def create_user(data):
-    now = get_wat_time()
+def build_user_doc(data, password_hash, now):
     user = {
         'first_name': data['first_name'].strip(),
         'last_name': data['last_name'].strip(),
@@ -111,7 +293,7 @@ def create_user(data):
         'level': data['level'].upper(),
         'whatsapp': data['whatsapp'],
         'email': data.get('email', '').strip().lower(),
-        'password': generate_password_hash(data['password']),
+        'password': password_hash,
         'created_at': now,
         'updated_at': now,
         'last_login': None,
@@ -119,6 +301,11 @@ def create_user(data):
         'last_seen': None,
         'last_notification_check': datetime.min.replace(tzinfo=timezone.utc)
     }
+    user['search_blob'] = build_search_blob(user)
+    return user
+
+def create_user(data):
+    user = build_user_doc(data, hash_password(data['password']), get_wat_time())
     result = users_collection.insert_one(user)
     return result.inserted_id
 
@@ -131,26 +318,30 @@ def signup():
     try:
         data = request.get_json()
         if not data:
-            return jsonify({'success': False, 'error': 'No data provided'}), 400
+            return ojsonify({'success': False, 'error': 'No data provided'}), 400
 
         errors = validate_signup_data(data)
         if errors:
-            return jsonify({'success': False, 'error': 'Validation failed', 'details': errors}), 400
+            return ojsonify({'success': False, 'error': 'Validation failed', 'details': errors}), 400
 
         if user_exists(data['nickname'], data['whatsapp']):
-            return jsonify({'success': False, 'error': 'User already exists'}), 400
+            return ojsonify({'success': False, 'error': 'User already exists'}), 400
 
-        user_id = create_user(data)
-        user = users_collection.find_one({'_id': user_id})
+        try:
+            user_id = create_user(data)
+        except DuplicateKeyError:
+            # Lost a race with a concurrent signup for the same nickname or number
+            return ojsonify({'success': False, 'error': 'User already exists'}), 400
+        user = users_collection.find_one({'_id': user_id}, _LIST_PROJECTION)
 
-        return jsonify({
+        return ojsonify({
             'success': True,
             'user': sanitize_user_data(user),
             'message': 'Registration successful'
         }), 201
 
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return ojsonify({'success': False, 'error': str(e)}), 500
 
 
 # --- Signin ---
@@ -159,44 +350,42 @@ def signin():
     try:
         data = request.get_json()
         if not data or 'nickname' not in data or 'password' not in data:
-            return jsonify({'success': False, 'error': 'Nickname and password are required'}), 400
+            return ojsonify({'success': False, 'error': 'Nickname and password are required'}), 400
 
-        user = users_collection.find_one({
-            'nickname': {'$regex': f'^{data["nickname"]}$', '$options': 'i'}
-        })
+        user = users_collection.find_one({'nickname': data['nickname'].strip().lower()}, _AUTH_PROJECTION)
 
-        if not user or not check_password_hash(user.get('password', ''), data['password']):
-            return jsonify({'success': False, 'error': 'Invalid credentials'}), 401
+        if not user or not verify_password(user, data['password']):
+            return ojsonify({'success': False, 'error': 'Invalid credentials'}), 401
+
+        # Only a verified login is recorded; the response reflects the new value
+        now = get_wat_time()
+        users_collection.update_one({'_id': user['_id']}, {'$set': {'last_login': now}})
+        user['last_login'] = now
 
         token_payload = {
             'user_id': str(user['_id']),
             'nickname': user['nickname'],
-            'exp': datetime.utcnow() + timedelta(hours=2)
+            'exp': int(time.time()) + _EXP_DELTA_SECONDS
         }
 
-        token = jwt.encode(token_payload, SECRET_KEY, algorithm='HS256')
+        token = _sign_hs256(token_payload)
 
-        users_collection.update_one(
-            {'_id': user['_id']},
-            {'$set': {'last_login': get_wat_time()}}
-        )
-
-        return jsonify({
+        return ojsonify({
             'success': True,
             'token': token,
             'user': sanitize_user_data(user)
         })
 
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return ojsonify({'success': False, 'error': str(e)}), 500
 
 
 # --- Get All Users (Admin Only) ---
 @users_bp.route('/api/users', methods=['GET'])
 def get_users():
     try:
-        page = int(request.args.get('page', 1))
-        per_page = int(request.args.get('per_page', 10))
+        # Clamped so $limit stays positive and the $facet result stays well under 16MB
+        page, per_page = get_page_args('per_page', 10)
         search = request.args.get('search', '')
         department = request.args.get('department', '')
         level = request.args.get('level', '')
@@ -204,12 +393,7 @@ def get_users():
 
         query = {}
         if search:
-            query['$or'] = [
-                {'first_name': {'$regex': search, '$options': 'i'}},
-                {'last_name': {'$regex': search, '$options': 'i'}},
-                {'nickname': {'$regex': search, '$options': 'i'}},
-                {'email': {'$regex': search, '$options': 'i'}}
-            ]
+            query['$text'] = {'$search': search}
         if department:
             query['department'] = department
         if level:
@@ -217,11 +401,19 @@ def get_users():
         if status:
             query['status'] = status.lower()
 
-        total = users_collection.count_documents(query)
         skip = (page - 1) * per_page
-        users = list(users_collection.find(query).skip(skip).limit(per_page))
-
-        return jsonify({
+        # Page and total count from one $match in a single round-trip
+        result = next(users_collection.aggregate([
+            {'$match': query},
+            {'$facet': {
+                'users': [{'$skip': skip}, {'$limit': per_page}, {'$project': _LIST_PROJECTION}],
+                'total': [{'$count': 'n'}]
+            }}
+        ]))
+        users = result['users']
+        total = result['total'][0]['n'] if result['total'] else 0
+
+        return ojsonify({
             'success': True,
             'users': [sanitize_user_data(user) for user in users],
             'total': total,
@@ -230,7 +422,7 @@ def get_users():
         })
 
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return ojsonify({'success': False, 'error': str(e)}), 500
 
 
 # --- Heartbeat (User must be authenticated) ---
@@ -238,19 +430,14 @@ def get_users():
 @requires_auth
 def user_heartbeat():
     try:
+        # $$NOW is fixed for the whole operation, so both fields get the same timestamp
         users_collection.update_one(
-            {'_id': ObjectId(request.user_id)},
-            {
-                '$set': {
-                    'status': 'online',
-                    'last_active': get_wat_time(),
-                    'last_seen': get_wat_time()
-                }
-            }
+            {'_id': g.user_oid},
+            [{'$set': {'status': 'online', 'last_active': _WAT_NOW, 'last_seen': _WAT_NOW}}]
         )
-        return jsonify({'success': True})
+        return ojsonify({'success': True})
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return ojsonify({'success': False, 'error': str(e)}), 500
 
 
 # --- Background Task ---
@@ -261,7 +448,7 @@ def check_user_status():
         idle_threshold = now - timedelta(minutes=STATUS_CONFIG['IDLE_THRESHOLD'])
         offline_threshold = now - timedelta(minutes=STATUS_CONFIG['OFFLINE_THRESHOLD'])
 
-        users_collection.update_many(
+        status_collection.update_many(
             {
                 'status': 'online',
                 'last_active': {'$lt': idle_threshold}
@@ -269,7 +456,7 @@ def check_user_status():
             {'$set': {'status': 'idle'}}
         )
 
-        users_collection.update_many(
+        status_collection.update_many(
             {
                 '$or': [{'status': 'online'}, {'status': 'idle'}],
                 'last_active': {'$lt': offline_threshold}
@@ -285,58 +472,63 @@ def check_user_status():
 @requires_auth
 def get_user_status(user_id):
     try:
-        user = users_collection.find_one(
-            {'_id': ObjectId(user_id)},
-            {'status': 1, 'last_active': 1, 'first_name': 1, 'department': 1}
+        oid = parse_object_id(user_id)
+        if oid is None:
+            return ojsonify({'success': False, 'error': 'Invalid user ID'}), 400
+
+        # Thresholds are measured from the server clock, so no datetimes are built per request
+        idle_threshold = {'$subtract': [_WAT_NOW, STATUS_CONFIG['IDLE_THRESHOLD'] * 60_000]}
+        offline_threshold = {'$subtract': [_WAT_NOW, STATUS_CONFIG['OFFLINE_THRESHOLD'] * 60_000]}
+
+        # Derive and persist the status in one round-trip; MongoDB skips the write when it is unchanged
+        user = users_collection.find_one_and_update(
+            {'_id': oid},
+            [{'$set': {'status': {'$switch': {
+                'branches': [
+                    {'case': {'$not': ['$last_active']}, 'then': '$status'},
+                    {'case': {'$lt': ['$last_active', offline_threshold]}, 'then': 'offline'},
+                    {'case': {'$lt': ['$last_active', idle_threshold]}, 'then': 'idle'}
+                ],
+                'default': '$status'
+            }}}}],
+            projection={'status': 1, 'last_active': 1, 'first_name': 1, 'department': 1},
+            return_document=ReturnDocument.AFTER
         )
 
         if not user:
-            return jsonify({'success': False, 'error': 'User not found'}), 404
+            return ojsonify({'success': False, 'error': 'User not found'}), 404
 
         status = user.get('status', 'offline')
         last_active = user.get('last_active')
 
-        if last_active:
-            inactive_for = (get_wat_time() - last_active).total_seconds() / 60
-
-            if inactive_for > STATUS_CONFIG['OFFLINE_THRESHOLD']:
-                status = 'offline'
-            elif inactive_for > STATUS_CONFIG['IDLE_THRESHOLD']:
-                status = 'idle'
-
-            if status != user.get('status'):
-                users_collection.update_one(
-                    {'_id': ObjectId(user_id)},
-                    {'$set': {'status': status}}
-                )
-
-        return jsonify({
+        return ojsonify({
             'success': True,
             'status': status,
-            'last_seen': last_active.isoformat() if last_active else None,
+            'last_seen': _to_wat_iso(last_active),
             'first_name': user.get('first_name'),
             'department': user.get('department'),
         })
 
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return ojsonify({'success': False, 'error': str(e)}), 500
 
 
 @users_bp.route('/api/users/<user_id>', methods=['DELETE'])
 def delete_user(user_id):
     try:
-        if not ObjectId.is_valid(user_id):
-            return jsonify({'success': False, 'error': 'Invalid user ID'}), 400
+        oid = parse_object_id(user_id)
+        if oid is None:
+            return ojsonify({'success': False, 'error': 'Invalid user ID'}), 400
 
-        result = users_collection.delete_one({'_id': ObjectId(user_id)})
+        result = users_collection.delete_one({'_id': oid})
 
         if result.deleted_count == 0:
-            return jsonify({'success': False, 'error': 'User not found'}), 404
+            return ojsonify({'success': False, 'error': 'User not found'}), 404
 
-        return jsonify({'success': True, 'message': 'User deleted successfully'})
+        return ojsonify({'success': True, 'message': 'User deleted successfully'})
 
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return ojsonify({'success': False, 'error': str(e)}), 500
     
 @users_bp.route('/api/users/bulk-create', methods=['POST'])
 def bulk_create_users():
@@ -344,33 +536,80 @@ def bulk_create_users():
         data = request.get_json()
 
         if not data or not isinstance(data, list):
-            return jsonify({'success': False, 'error': 'Invalid data: Expected a list of user objects'}), 400
+            return ojsonify({'success': False, 'error': 'Invalid data: Expected a list of user objects'}), 400
 
         created = []
         skipped = []
+        valid = []
+        errors = []
 
         for index, user_data in enumerate(data, start=1):
-            errors = validate_signup_data(user_data)
-            if errors:
+            # errors is reused across rows, so rejected rows keep a copy
+            if validate_signup_data(user_data, errors):
                 skipped.append({
                     'index': index,
                     'nickname': user_data.get('nickname', ''),
-                    'errors': errors
+                    'errors': list(errors)
                 })
                 continue
-
-            if user_exists(user_data['nickname'], user_data['whatsapp']):
+            valid.append((index, user_data))
+
+        # One round-trip to find every nickname/whatsapp already taken
+        nicknames = [user_data['nickname'].strip().lower() for _, user_data in valid]
+        whatsapps = [user_data['whatsapp'] for _, user_data in valid]
+        taken_nicknames = set()
+        taken_whatsapps = set()
+        if valid:
+            for user in users_collection.find(
+                {'$or': [{'nickname': {'$in': nicknames}}, {'whatsapp': {'$in': whatsapps}}]},
+                {'nickname': 1, 'whatsapp': 1}
+            ):
+                taken_nicknames.add(user.get('nickname'))
+                taken_whatsapps.add(user.get('whatsapp'))
+
+        to_insert = []
+        for (index, user_data), nickname in zip(valid, nicknames):
+            # Duplicates inside the payload itself are caught by the same sets
+            if nickname in taken_nicknames or user_data['whatsapp'] in taken_whatsapps:
                 skipped.append({
                     'index': index,
                     'nickname': user_data['nickname'],
                     'errors': ['User already exists']
                 })
                 continue
-
-            user_id = create_user(user_data)
-            created.append(str(user_id))
-
-        return jsonify({
+            taken_nicknames.add(nickname)
+            taken_whatsapps.add(user_data['whatsapp'])
+            to_insert.append((index, user_data))
+
+        if to_insert:
+            # argon2-cffi releases the GIL while hashing, so threads run in parallel
+            with ThreadPoolExecutor(max_workers=MAX_HASH_WORKERS) as executor:
+                hashes = list(executor.map(hash_password, [user_data['password'] for _, user_data in to_insert]))
+
+            now = get_wat_time()
+            docs = [build_user_doc(user_data, password_hash, now)
+                    for (_, user_data), password_hash in zip(to_insert, hashes)]
+            failed = {}
+            try:
+                users_collection.insert_many(docs, ordered=False)
+            except BulkWriteError as e:
+                # Rows that lost a race with a concurrent signup; the rest were inserted
+                failed = {error['index']: error for error in e.details.get('writeErrors', [])}
+
+            for position, ((index, user_data), doc) in enumerate(zip(to_insert, docs)):
+                if position in failed:
+                    skipped.append({
+                        'index': index,
+                        'nickname': user_data['nickname'],
+                        'errors': ['User already exists' if failed[position].get('code') == 11000
+                                   else failed[position].get('errmsg', 'Insert failed')]
+                    })
+                else:
+                    created.append(str(doc['_id']))
+
+        skipped.sort(key=lambda row: row['index'])
+
+        return ojsonify({
             'success': True,
             'created_count': len(created),
             'skipped_count': len(skipped),
@@ -379,6 +618,6 @@ def bulk_create_users():
         }), 201
 
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        return ojsonify({'success': False, 'error': str(e)}), 500
 
-print("✅ Users module initialized")
\ No newline at end of file
+print("✅ Users module initialized")
\ No newline at end of file